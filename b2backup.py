@@ -1,21 +1,27 @@
 #!/usr/bin/python3
 
 """Module providing backups to B2."""
+import concurrent.futures
+import functools
 import hashlib
-import gc
-import mmap
 import os
+import pickle
 import re
+import shutil
+import subprocess
 import sys
 import tarfile
+import threading
 import time
 from datetime import date
 from datetime import datetime
 from datetime import timedelta
 import requests
-import yaml
-import nacl.secret
-import nacl.utils
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+# yaml and nacl are imported lazily in the functions that need them: loading the YAML
+# C extension and libsodium bindings is a measurable share of startup, and runs that hit
+# the config cache or only list files never pay for it.
 
 
 # Constants
@@ -24,8 +30,22 @@ CONFIG_FILE_NAME = 'config.yaml'
 THISMONTH = '{:%Y%m}01'.format(date.today())
 THREE_MONTHS_AGO = '{:%Y%m}01'.format(date.today() - timedelta(weeks=12))
 BACKUP_DIRECTORY_DEFAULT = '.'
-ENCRYPTED_FILE_PART_SIZE_DEFAULT = 1024
+# Backup volumes are largely already-compressed media, where high gzip levels cost several
+# times the CPU for a few percent better ratio.
+COMPRESSLEVEL_DEFAULT = 1
+COMPRESSION_DEFAULT = 'gzip'
+# Maps each supported 'compression' config value to its archive file suffix.  'none' skips
+# compression entirely, which is the cheapest choice when volumes hold already-compressed
+# media.
+ARCHIVE_SUFFIXES = {'gzip': '.tar.gz', 'zstd': '.tar.zst', 'none': '.tar'}
+# Defaulting above B2's 5 MB minimum part size keeps the large file upload path usable
+# out of the box.
+ENCRYPTED_FILE_PART_SIZE_DEFAULT = 8 * 1024 * 1024
+ENCRYPTED_FILE_PART_SIZE_MINIMUM = 64 * 1024
 B2_AUTHORIZATION_URL = 'https://api.backblazeb2.com/b2api/v2/b2_authorize_account'
+# B2 large files must have at least two parts, and every part except the last must be at
+# least this many bytes.
+B2_MINIMUM_PART_SIZE = 5 * 1000 * 1000
 UPLOAD_ATTEMPTS = 6
 BACKOFF_MODIFIER = 225
 ACTIVE_PERIOD_BEGIN_HOUR = 20
@@ -33,6 +53,28 @@ ACTIVE_PERIOD_END_HOUR = 8
 ESTIMATED_UPLOAD_TIME = 30
 DISABLE_PAUSE = False
 DEBUG = False
+UPLOAD_WORKERS_DEFAULT = 8
+
+# Shared HTTP session.  Reuses TCP+TLS connections across B2 API calls instead of paying a
+# fresh handshake per request.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=16,
+                                      pool_maxsize=32,
+                                      max_retries=Retry(total=3,
+                                                        backoff_factor=0.5,
+                                                        status_forcelist=[429, 500, 502, 503, 504],
+                                                        allowed_methods=None)))
+
+# Per-thread cached B2 upload URL.  B2 requires a distinct upload URL per concurrent
+# uploader, and each URL is reusable until it fails.
+UPLOAD_URL_CACHE = threading.local()
+
+# Serializes the active-period pause check so a single thread handles the sleep and re-auth.
+PAUSE_LOCK = threading.Lock()
+
+# Caches the computed active-period window, keyed per day, so the per-part checks reduce to
+# a dict lookup and two comparisons.
+ACTIVE_PERIOD_CACHE = {}
 
 
 # Methods
@@ -56,8 +98,35 @@ def read_config(config_file_name=CONFIG_FILE_NAME):
     if os.path.isfile(config_file_name):
         # Attempt to open file.  Otherwise, print an error.
         try:
+            # A pickle of the parsed config, keyed on the YAML file's mtime, skips the
+            # YAML parse on repeat runs.  The cache lives next to the config file and is
+            # rebuilt whenever the YAML is newer.
+            cache_file_name = f'{config_file_name}.cache'
+            try:
+                if os.path.getmtime(cache_file_name) >= os.path.getmtime(config_file_name):
+                    with open(cache_file_name, 'rb') as cache_file:
+                        return pickle.load(cache_file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+
+            import yaml
+            try:
+                # The libyaml C loader parses much faster than the pure-Python SafeLoader.
+                from yaml import CSafeLoader as SafeLoader
+            except ImportError:
+                from yaml import SafeLoader
+
             with open(config_file_name) as config_file:
-                config = yaml.safe_load(config_file)
+                config = yaml.load(config_file, Loader=SafeLoader)
+
+            try:
+                # The cache duplicates the secrets in the YAML, so create it owner-only
+                # rather than with the default umask.
+                with open(os.open(cache_file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600),
+                          'wb') as cache_file:
+                    pickle.dump(config, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError:
+                pass
 
             return config
         except FileNotFoundError:
@@ -123,35 +192,114 @@ def check_and_update_config(config,
         if 'backup_directory' not in config:
             config['backup_directory'] = backup_directory_default
 
-        # Default 'encrypted_file_part_size' to 1M.
+        # Default 'encrypted_file_part_size' to 8M.  Sizes are in bytes.
         if 'encrypted_file_part_size' not in config:
             config['encrypted_file_part_size'] = encrypted_file_part_size_default
 
+        # Tiny part sizes turn a multi-GB archive into millions of part files, each paying
+        # fixed per-part overhead.  Reject anything below 64K.
+        if config['encrypted_file_part_size'] < ENCRYPTED_FILE_PART_SIZE_MINIMUM:
+            format_log(f'encrypted_file_part_size must be at least {ENCRYPTED_FILE_PART_SIZE_MINIMUM} bytes.')
+            sys.exit(1)
+
+        # Default 'compresslevel' to fast compression.
+        if 'compresslevel' not in config:
+            config['compresslevel'] = COMPRESSLEVEL_DEFAULT
+
+        # Default 'compression' to gzip, and derive the archive suffix every filename is
+        # built from.
+        if 'compression' not in config:
+            config['compression'] = COMPRESSION_DEFAULT
+
+        if config['compression'] not in ARCHIVE_SUFFIXES:
+            format_log(f"compression must be one of: {', '.join(ARCHIVE_SUFFIXES)}.")
+            sys.exit(1)
+
+        config['archive_suffix'] = ARCHIVE_SUFFIXES[config['compression']]
+
+        # Precompute the escaped volume-name alternation every listing pattern embeds.
+        config['volumes_pattern'] = '|'.join(re.escape(volume) for volume in config['volumes'])
+
+        # Default 'upload_workers' to UPLOAD_WORKERS_DEFAULT concurrent part uploads.
+        if 'upload_workers' not in config:
+            config['upload_workers'] = UPLOAD_WORKERS_DEFAULT
+
         config = check_and_update_b2(config)
 
     return config
 
 
+def create_archive(config, volume, thismonth=THISMONTH):
+    """Function creating the local archive for a single volume."""
+    format_log(f'Archiving volume: {volume}')
+    archive_path = f"{config['backup_directory']}/{thismonth}-{volume}{config['archive_suffix']}"
+    if shutil.which('tar'):
+        # GNU tar does the per-file stat/header work in C, and pigz/zstd (when available)
+        # run the compression on all cores.  Python's tarfile frontend spends most of its
+        # time in per-file TarInfo construction on trees with many small files.
+        tar_command = ['tar', '-C', config['backup_directory'], '-cf', archive_path, volume]
+        if config['compression'] == 'gzip':
+            if shutil.which('pigz'):
+                compress_program = f"pigz -p {os.cpu_count()} -{config['compresslevel']}"
+            else:
+                compress_program = f"gzip -{config['compresslevel']}"
+            tar_command.insert(1, f'--use-compress-program={compress_program}')
+        elif config['compression'] == 'zstd':
+            if not shutil.which('zstd'):
+                format_log('compression is set to zstd, but zstd is not installed.')
+                sys.exit(1)
+            tar_command.insert(1, f"--use-compress-program=zstd -T0 -{config['compresslevel']}")
+        result = subprocess.run(tar_command, check=False)
+        if result.returncode != 0:
+            format_log(f'tar failed for volume {volume} with exit code {result.returncode}.')
+            sys.exit(1)
+    elif config['compression'] == 'zstd':
+        # tarfile has no zstd support.
+        format_log('compression is set to zstd, but tar is not installed.')
+        sys.exit(1)
+    elif config['compression'] == 'gzip':
+        with tarfile.open(archive_path, 'w:gz', compresslevel=config['compresslevel']) as tar:
+            tar.add(f"{config['backup_directory']}/{volume}", arcname=volume)
+    else:
+        with tarfile.open(archive_path, 'w') as tar:
+            tar.add(f"{config['backup_directory']}/{volume}", arcname=volume)
+
 def create_archives(config, thismonth=THISMONTH):
-    """Function creating local archives using tar and gzip."""
+    """Function creating local archives for all volumes in parallel."""
     format_log('Archiving volumes.')
 
-    current_directory = os.getcwd()
-    os.chdir(config['backup_directory'])
-
-    for volume in config['volumes']:
-        format_log(f'Archiving volume: {volume}')
-        with tarfile.open(f"{config['backup_directory']}/{thismonth}-{volume}.tar.gz",'w:gz') as tar:
-            tar.add(volume)
-
-    os.chdir(current_directory)
+    # Volumes are independent, so archive them concurrently.  Threads are enough here:
+    # the heavy lifting happens in the tar/pigz subprocesses (or releases the GIL in
+    # zlib for the tarfile fallback).
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(config['volumes']), os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(create_archive, config, volume, thismonth)
+                   for volume in config['volumes']]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+
+def volumes_pattern(config):
+    """Function returning the precomputed regex alternation of the volume names."""
+    return config['volumes_pattern']
+
+def archive_suffix_pattern(config):
+    """Function building a regex fragment matching the configured archive suffix."""
+    return re.escape(config['archive_suffix'])
+
+@functools.lru_cache(maxsize=8)
+def directory_snapshot(directory, mtime_ns):
+    """Function returning a sorted snapshot of a directory, cached on its mtime."""
+    # mtime_ns is only here as a cache key: any file created or deleted in the directory
+    # bumps its mtime and invalidates the cached listing.
+    with os.scandir(directory) as entries:
+        return tuple(sorted(entry.name for entry in entries))
 
 def list_files_matching(match_pattern, directory):
-    """Function listing files that match a given Regular Expression"""
+    """Function listing files that match a given compiled Regular Expression"""
     file_list = []
 
-    for filename in sorted(os.listdir(directory)):
-        if re.search(match_pattern, filename):
+    for filename in directory_snapshot(directory, os.stat(directory).st_mtime_ns):
+        if match_pattern.match(filename):
             file_list.append(filename)
 
     return file_list
@@ -159,75 +307,128 @@ def list_files_matching(match_pattern, directory):
 def list_local_archives(config):
     """Function listing local tar'd and gzip'd archives."""
     format_log('List local archived volumes.')
-    file_list = list_files_matching(rf"\d+-({'|'.join(config['volumes'])})\.tar\.gz", config['backup_directory'])
+    file_list = list_files_matching(re.compile(rf"\d+-({volumes_pattern(config)}){archive_suffix_pattern(config)}"),
+                                    config['backup_directory'])
     for filename in file_list:
         format_log(filename)
 
 def encrypt_archives(config, thismonth=THISMONTH):
     """Function encrypting archives with PyNaCl.  Output encrypted files of size encrypted_file_part_size."""
     format_log('Encrypting volumes.')
-    for volume in config['volumes']:
-        with open(f"{config['backup_directory']}/{thismonth}-{volume}.tar.gz", 'rb') as volume_file:
-            with mmap.mmap(volume_file.fileno(), 0, access=mmap.ACCESS_READ) as volume_file_mmap:
-                last_byte = volume_file_mmap.size() - 1
+    import nacl.secret
+
+    part_overhead = nacl.secret.SecretBox.NONCE_SIZE + nacl.secret.SecretBox.MACBYTES
+    max_workers = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for volume in config['volumes']:
+            with open(f"{config['backup_directory']}/{thismonth}-{volume}{config['archive_suffix']}", 'rb') as volume_file:
+                if hasattr(os, 'posix_fadvise'):
+                    # The archive is read strictly front-to-back; ask the kernel for a
+                    # larger readahead window.
+                    os.posix_fadvise(volume_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                archive_stat = os.fstat(volume_file.fileno())
+                archive_size = archive_stat.st_size
                 part_number = 1
-                while volume_file_mmap.tell() <= last_byte:
-                    box = nacl.secret.SecretBox(config['secret_key'])
-                    encrypted_volume_contents_part = box.encrypt(
-                                                             volume_file_mmap.read(config['encrypted_file_part_size']))
-                    with open(
-                            f"{config['backup_directory']}/{thismonth}-{volume}.tar.gz.enc.part{part_number:03d}.sha1",
-                            'w') as encrypted_volume_file_part_hash:
-                        encrypted_volume_file_part_hash.write(checksum(encrypted_volume_contents_part))
-                    with open(f"{config['backup_directory']}/{thismonth}-{volume}.tar.gz.enc.part{part_number:03d}",
-                              'wb') as encrypted_volume_file_part:
-                        encrypted_volume_file_part.write(encrypted_volume_contents_part)
-                    # HACKTAG: I suspect this is really awful.  :D  How else could we do it?
-                    # Experimenting with pseudo-manual memory management.  Delete
-                    # encrypted_volume_contents_part variable, and force garbage collection.
-                    del encrypted_volume_contents_part
-                    gc.collect()
+                offset = 0
+                futures = set()
+                while offset < archive_size:
+                    plaintext_size = min(config['encrypted_file_part_size'], archive_size - offset)
+                    # Resume after an interruption: a part file whose size matches its
+                    # plaintext plus the nonce+MAC overhead, and which is newer than the
+                    # archive itself, is already done, so skip the read and re-encryption
+                    # entirely.  The mtime check keeps a rerun from reusing parts of an
+                    # older archive after create_archives regenerated it.
+                    part_path = (f"{config['backup_directory']}/{thismonth}-{volume}"
+                                 f"{config['archive_suffix']}.enc.part{part_number:03d}")
+                    if (os.path.isfile(part_path)
+                            and os.path.getsize(part_path) == plaintext_size + part_overhead
+                            and os.path.getmtime(part_path) >= archive_stat.st_mtime):
+                        volume_file.seek(plaintext_size, os.SEEK_CUR)
+                    else:
+                        volume_contents_part = volume_file.read(plaintext_size)
+                        # Bound the in-flight parts so a multi-GB archive never sits in
+                        # memory all at once.
+                        if len(futures) >= max_workers * 2:
+                            done, futures = concurrent.futures.wait(
+                                    futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                            for future in done:
+                                future.result()
+                        futures.add(executor.submit(encrypt_archive_part, config, volume, part_number,
+                                                    volume_contents_part, thismonth))
+                    offset += plaintext_size
                     part_number += 1
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+
+def encrypt_archive_part(config, volume, part_number, volume_contents_part, thismonth=THISMONTH):
+    """Function encrypting and writing a single archive part."""
+    # Call libsodium directly.  The part layout (nonce followed by ciphertext) stays
+    # identical to SecretBox.encrypt, so decrypt_archives is unaffected, but the per-part
+    # SecretBox/EncryptedMessage wrappers go away.  The C call releases the GIL, so parts
+    # encrypt in parallel across worker threads.
+    import nacl.bindings
+    import nacl.utils
+
+    nonce = nacl.utils.random(nacl.bindings.crypto_secretbox_NONCEBYTES)
+    encrypted_volume_contents_part = nonce + nacl.bindings.crypto_secretbox(
+                                         volume_contents_part, nonce, config['secret_key'])
+    with open(f"{config['backup_directory']}/{thismonth}-{volume}{config['archive_suffix']}.enc.part{part_number:03d}",
+              'wb') as encrypted_volume_file_part:
+        encrypted_volume_file_part.write(encrypted_volume_contents_part)
 
 def list_local_encrypted_archives(config):
     """Function listing local encrypted archives."""
     format_log('List local encrypted volumes.')
-    file_list = list_files_matching(rf"\d+-({'|'.join(config['volumes'])})\.tar\.gz\.enc", config['backup_directory'])
+    file_list = list_files_matching(re.compile(rf"\d+-({volumes_pattern(config)}){archive_suffix_pattern(config)}\.enc"),
+                                    config['backup_directory'])
     for filename in file_list:
         format_log(filename)
 
 def decrypt_archives(config, thismonth=THISMONTH):
     """Function decrypting archives with PyNaCl.  Input encrypted file parts, and output decrypted archive."""
     format_log('Decrypting volumes.')
-    for volume in config['volumes']:
-        part_number = 1
-        while os.path.isfile(f"{config['backup_directory']}/{thismonth}-{volume}.tar.gz.enc.part{part_number:03d}"):
-            with open(f"{config['backup_directory']}/{thismonth}-{volume}.tar.gz.enc.part{part_number:03d}",
-                      'rb') as encrypted_volume_file_part:
-                encrypted_volume_contents_part = encrypted_volume_file_part.read()
-                box = nacl.secret.SecretBox(config['secret_key'])
-                volume_contents_part = box.decrypt(encrypted_volume_contents_part)
-                # HACKTAG: I suspect this is really awful.  :D  How else could we do it?
-                # Experimenting with pseudo-manual memory management.  Delete
-                # encrypted_volume_contents_part variable, and force garbage collection.
-                del encrypted_volume_contents_part
-                gc.collect()
-                with open(f"{config['backup_directory']}/{thismonth}-{volume}.tar.gz", 'ab') as volume_file:
-                    volume_file.write(volume_contents_part)
-                # HACKTAG: I suspect this is really awful.  :D  How else could we do it?
-                # Experimenting with pseudo-manual memory management.  Delete
-                # volume_contents_part variable, and force garbage collection.
-                del volume_contents_part
-                gc.collect()
-            part_number += 1
-
-def checksum(byte_string):
-    """Function computing a checksum on a string."""
-    return hashlib.sha1(byte_string).hexdigest()
+    import nacl.secret
+
+    box = nacl.secret.SecretBox(config['secret_key'])
+    part_overhead = nacl.secret.SecretBox.NONCE_SIZE + nacl.secret.SecretBox.MACBYTES
+    max_workers = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for volume in config['volumes']:
+            part_paths = []
+            part_number = 1
+            while os.path.isfile(f"{config['backup_directory']}/{thismonth}-{volume}{config['archive_suffix']}.enc.part{part_number:03d}"):
+                part_paths.append(f"{config['backup_directory']}/{thismonth}-{volume}{config['archive_suffix']}.enc.part{part_number:03d}")
+                part_number += 1
+
+            if part_paths == []:
+                continue
+
+            with open(f"{config['backup_directory']}/{thismonth}-{volume}{config['archive_suffix']}", 'wb',
+                      buffering=4 * 1024 * 1024) as volume_file:
+                # The plaintext size is known up front, so reserve the extent once instead of
+                # growing the file write by write.
+                expected_size = sum(os.stat(part_path).st_size - part_overhead for part_path in part_paths)
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(volume_file.fileno(), 0, expected_size)
+                # Decrypt parts ahead in worker threads while writing strictly in order.
+                # The window bounds how many decrypted parts sit in memory at once.
+                pending = []
+                for part_path in part_paths:
+                    pending.append(executor.submit(decrypt_archive_part, box, part_path))
+                    if len(pending) >= max_workers * 2:
+                        volume_file.write(pending.pop(0).result())
+                while pending:
+                    volume_file.write(pending.pop(0).result())
+
+def decrypt_archive_part(box, part_path):
+    """Function reading and decrypting a single archive part."""
+    # libsodium releases the GIL, so parts decrypt in parallel across worker threads.
+    with open(part_path, 'rb') as encrypted_volume_file_part:
+        return box.decrypt(encrypted_volume_file_part.read())
 
 def b2_authorize_account(config, b2_authorization_url=B2_AUTHORIZATION_URL, debug=DEBUG):
     """Function authorizing B2 account."""
-    response = requests.get(b2_authorization_url, auth=(config['b2_key_id'], config['b2_key_value']))
+    response = SESSION.get(b2_authorization_url, auth=(config['b2_key_id'], config['b2_key_value']))
     if debug:
         format_log(response.text)
 
@@ -243,43 +444,126 @@ def b2_authorize_account(config, b2_authorization_url=B2_AUTHORIZATION_URL, debu
     sys.exit(1)
 
 def b2_list_files(config, prefix='', max_file_count=1000, debug=DEBUG):
-    """Function listing files in a B2 bucket."""
+    """Function listing files in a B2 bucket.  Follows pagination past max_file_count."""
+    files = []
+    start_file_name = ''
+    while True:
+        try:
+            response = SESSION.post(f"{config['api_url']}/b2api/v2/b2_list_file_names",
+                                     headers={'Authorization': config['auth_token']},
+                                     json={'bucketId': config['b2_bucket_id'],
+                                           'maxFileCount': max_file_count,
+                                           'startFileName': start_file_name,
+                                           'prefix': prefix})
+            if debug:
+                format_log(response.text)
+
+            if response.status_code == 200:
+                for file_json in response.json()['files']:
+                    files.append((file_json['fileName'], file_json['fileId']))
+                # nextFileName is null once the listing is exhausted.
+                if response.json()['nextFileName'] is None:
+                    return files
+                start_file_name = response.json()['nextFileName']
+                continue
+
+            format_log(f'HTTP Status Code: {response.status_code}')
+        except requests.exceptions.ConnectionError as err:
+            format_log(f"A ConnectionError occurred for b2_list_file_names: {err}")
+        except requests.exceptions.RequestException as err:
+            format_log(f'A RequestException occurred: {err}')
+
+        format_log('Failed to list files on B2.')
+        return []
+
+def b2_get_upload_url(api_url, auth_token, b2_bucket_id, debug=DEBUG):
+    """Function getting upload URL for a B2 bucket."""
+    try:
+        response = SESSION.post(f"{api_url}/b2api/v2/b2_get_upload_url",
+                                 headers={'Authorization': auth_token},
+                                 json={'bucketId': b2_bucket_id})
+        if debug:
+            format_log(response.text)
+
+        if response.status_code == 200:
+            format_log('Got upload URL from B2.')
+            upload_url = response.json()['uploadUrl']
+            upload_auth_token = response.json()['authorizationToken']
+            return upload_url, upload_auth_token
+
+        format_log(f'HTTP Status Code: {response.status_code}')
+    except requests.exceptions.ConnectionError as err:
+        format_log(f"A ConnectionError occurred for {api_url}: {err}")
+    except requests.exceptions.RequestException as err:
+        format_log(f'A RequestException occurred: {err}')
+
+    format_log('Failed to get upload URL from B2.')
+    return None, None
+
+def b2_upload_file(volume, file_info, upload_url, upload_auth_token, debug=DEBUG):
+    """Function interacting with B2 API to upload file to a B2 bucket."""
     try:
-        response = requests.post(f"{config['api_url']}/b2api/v2/b2_list_file_names",
+        # Passing the open file streams the body in chunks instead of holding the whole
+        # part in the Python heap.
+        with open(file_info['file_path'], 'rb') as file_part:
+            response = SESSION.post(upload_url,
+                                     headers={'Authorization': upload_auth_token,
+                                              'X-Bz-File-Name': f"{volume}/{file_info['file_name']}",
+                                              'Content-Type': 'application/octet-stream',
+                                              'Content-Length': file_info['file_size'],
+                                              'X-Bz-Content-Sha1': file_info['file_hash']},
+                                     data=file_part)
+        if debug:
+            format_log(response.text)
+
+        if response.status_code == 200:
+            format_log(f"Uploaded {file_info['file_name']} to B2.")
+            return True
+
+        format_log(f'HTTP Status Code: {response.status_code}')
+    except requests.exceptions.ConnectionError as err:
+        format_log(f"A ConnectionError occurred for {file_info['file_name']}: {err}")
+    except requests.exceptions.RequestException as err:
+        format_log(f'A RequestException occurred: {err}')
+
+    format_log(f"Failed to upload {file_info['file_name']} to B2.")
+    return False
+
+def b2_start_large_file(config, file_name, debug=DEBUG):
+    """Function starting a B2 large file upload.  Returns the new file ID."""
+    try:
+        response = SESSION.post(f"{config['api_url']}/b2api/v2/b2_start_large_file",
                                  headers={'Authorization': config['auth_token']},
-                                 data=f"{{\"bucketId\": \"{config['b2_bucket_id']}\", \
-                                          \"maxFileCount\": {max_file_count}, \
-                                          \"prefix\": \"{prefix}\"}}")
+                                 json={'bucketId': config['b2_bucket_id'],
+                                       'fileName': file_name,
+                                       'contentType': 'application/octet-stream'})
         if debug:
             format_log(response.text)
 
         if response.status_code == 200:
-            files = []
-            for file_json in response.json()['files']:
-                files.append((file_json['fileName'], file_json['fileId']))
-            return files
+            format_log(f'Started large file {file_name} on B2.')
+            return response.json()['fileId']
 
         format_log(f'HTTP Status Code: {response.status_code}')
     except requests.exceptions.ConnectionError as err:
-        format_log(f"A ConnectionError occurred for b2_list_file_names: {err}")
-    except:
-        format_log('An unknown error occurred.')
-        format_log(sys.exc_info())
+        format_log(f"A ConnectionError occurred for b2_start_large_file: {err}")
+    except requests.exceptions.RequestException as err:
+        format_log(f'A RequestException occurred: {err}')
 
-    format_log('Failed to list files on B2.')
-    return []
+    format_log(f'Failed to start large file {file_name} on B2.')
+    return None
 
-def b2_get_upload_url(api_url, auth_token, b2_bucket_id, debug=DEBUG):
-    """Function getting upload URL for a B2 bucket."""
+def b2_get_upload_part_url(api_url, auth_token, file_id, debug=DEBUG):
+    """Function getting upload URL for the parts of a B2 large file."""
     try:
-        response = requests.post(f"{api_url}/b2api/v2/b2_get_upload_url",
+        response = SESSION.post(f"{api_url}/b2api/v2/b2_get_upload_part_url",
                                  headers={'Authorization': auth_token},
-                                 data='{"bucketId": "%s"}' % b2_bucket_id)
+                                 json={'fileId': file_id})
         if debug:
             format_log(response.text)
 
         if response.status_code == 200:
-            format_log('Got upload URL from B2.')
+            format_log('Got upload part URL from B2.')
             upload_url = response.json()['uploadUrl']
             upload_auth_token = response.json()['authorizationToken']
             return upload_url, upload_auth_token
@@ -287,66 +571,117 @@ def b2_get_upload_url(api_url, auth_token, b2_bucket_id, debug=DEBUG):
         format_log(f'HTTP Status Code: {response.status_code}')
     except requests.exceptions.ConnectionError as err:
         format_log(f"A ConnectionError occurred for {api_url}: {err}")
-    except:
-        format_log('An unknown error occurred.')
-        format_log(sys.exc_info())
+    except requests.exceptions.RequestException as err:
+        format_log(f'A RequestException occurred: {err}')
 
-    format_log('Failed to get upload URL from B2.')
+    format_log('Failed to get upload part URL from B2.')
     return None, None
 
-def b2_upload_file(volume, file_info, upload_url, upload_auth_token, debug=DEBUG):
-    """Function interacting with B2 API to upload file to a B2 bucket."""
+def b2_upload_part(file_info, part_number, upload_url, upload_auth_token, debug=DEBUG):
+    """Function interacting with B2 API to upload one part of a large file."""
     try:
-        response = requests.post(upload_url,
-                                 headers={'Authorization': upload_auth_token,
-                                          'X-Bz-File-Name': f"{volume}/{file_info['file_name']}",
-                                          'Content-Type': 'application/octet-stream',
-                                          'Content-Length': file_info['file_size'],
-                                          'X-Bz-Content-Sha1': file_info['file_hash']},
-                                 data=file_info['file_contents'])
+        # Passing the open file streams the body in chunks instead of holding the whole
+        # part in the Python heap.
+        with open(file_info['file_path'], 'rb') as file_part:
+            response = SESSION.post(upload_url,
+                                     headers={'Authorization': upload_auth_token,
+                                              'X-Bz-Part-Number': str(part_number),
+                                              'Content-Length': file_info['file_size'],
+                                              'X-Bz-Content-Sha1': file_info['file_hash']},
+                                     data=file_part)
         if debug:
             format_log(response.text)
 
         if response.status_code == 200:
-            format_log(f"Uploaded {file_info['file_name']} to B2.")
+            format_log(f"Uploaded {file_info['file_name']} as part {part_number} to B2.")
             return True
 
         format_log(f'HTTP Status Code: {response.status_code}')
     except requests.exceptions.ConnectionError as err:
         format_log(f"A ConnectionError occurred for {file_info['file_name']}: {err}")
-    except:
-        format_log('An unknown error occurred.')
-        format_log(sys.exc_info())
+    except requests.exceptions.RequestException as err:
+        format_log(f'A RequestException occurred: {err}')
 
-    format_log(f"Failed to upload {file_info['file_name']} to B2.")
+    format_log(f"Failed to upload {file_info['file_name']} as part {part_number} to B2.")
+    return False
+
+def b2_finish_large_file(config, file_id, part_sha1_array, debug=DEBUG):
+    """Function finishing a B2 large file from its uploaded part checksums."""
+    try:
+        response = SESSION.post(f"{config['api_url']}/b2api/v2/b2_finish_large_file",
+                                 headers={'Authorization': config['auth_token']},
+                                 json={'fileId': file_id, 'partSha1Array': part_sha1_array})
+        if debug:
+            format_log(response.text)
+
+        if response.status_code == 200:
+            format_log(f'Finished large file {file_id} on B2.')
+            return True
+
+        format_log(f'HTTP Status Code: {response.status_code}')
+    except requests.exceptions.ConnectionError as err:
+        format_log(f"A ConnectionError occurred for b2_finish_large_file: {err}")
+    except requests.exceptions.RequestException as err:
+        format_log(f'A RequestException occurred: {err}')
+
+    format_log(f'Failed to finish large file {file_id} on B2.')
+    return False
+
+def b2_cancel_large_file(config, file_id, debug=DEBUG):
+    """Function cancelling an unfinished B2 large file."""
+    try:
+        response = SESSION.post(f"{config['api_url']}/b2api/v2/b2_cancel_large_file",
+                                 headers={'Authorization': config['auth_token']},
+                                 json={'fileId': file_id})
+        if debug:
+            format_log(response.text)
+
+        if response.status_code == 200:
+            format_log(f'Cancelled large file {file_id} on B2.')
+            return True
+
+        format_log(f'HTTP Status Code: {response.status_code}')
+    except requests.exceptions.ConnectionError as err:
+        format_log(f"A ConnectionError occurred for b2_cancel_large_file: {err}")
+    except requests.exceptions.RequestException as err:
+        format_log(f'A RequestException occurred: {err}')
+
+    format_log(f'Failed to cancel large file {file_id} on B2.')
     return False
 
 def get_file_info(file_part_name, backup_directory):
-    """Function gathering file info."""
-    file_size = str(os.stat(f"{backup_directory}/{file_part_name}").st_size)
-    file_hash = b''
-    file_contents = b''
-    with open(f"{backup_directory}/{file_part_name}.sha1", 'rb') as file_part_hash:
-        file_hash = file_part_hash.read()
-    with open(f"{backup_directory}/{file_part_name}", 'rb') as file_part:
-        with mmap.mmap(file_part.fileno(), 0, access=mmap.ACCESS_READ) as file_part_mmap:
-            file_contents = file_part_mmap.read()
+    """Function gathering file info.  Hashes the part without holding it all in memory."""
+    file_path = f"{backup_directory}/{file_part_name}"
+    file_size = str(os.stat(file_path).st_size)
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file_part:
+        while file_part_chunk := file_part.read(1024 * 1024):
+            sha1.update(file_part_chunk)
     return {'file_name': file_part_name,
             'file_size': file_size,
-            'file_hash': file_hash,
-            'file_contents': file_contents}
+            'file_hash': sha1.hexdigest(),
+            'file_path': file_path}
 
 def active_upload_period(check_time,
                          active_period_begin_hour=ACTIVE_PERIOD_BEGIN_HOUR,
                          active_period_end_hour=ACTIVE_PERIOD_END_HOUR):
     """Function determining whether upload execution is within active upload period."""
-    if check_time.hour >= active_period_begin_hour:
-        active_period_begin = datetime(check_time.year, check_time.month, check_time.day, active_period_begin_hour)
-    else:
-        active_period_begin = datetime(check_time.year, check_time.month, check_time.day - 1, active_period_begin_hour)
-
-    active_period_end = datetime(check_time.year, check_time.month, active_period_begin.day + 1, active_period_end_hour)
-
+    cache_key = (check_time.date(), check_time.hour >= active_period_begin_hour,
+                 active_period_begin_hour, active_period_end_hour)
+    if cache_key not in ACTIVE_PERIOD_CACHE:
+        active_period_begin = datetime(check_time.year, check_time.month, check_time.day,
+                                       active_period_begin_hour)
+        if check_time.hour < active_period_begin_hour:
+            # The current period began yesterday evening.  timedelta arithmetic handles
+            # month and year boundaries, where constructing datetime(..., day - 1) raised
+            # ValueError on the first of the month.
+            active_period_begin -= timedelta(days=1)
+
+        active_period_end = active_period_begin + timedelta(
+                hours=24 - active_period_begin_hour + active_period_end_hour)
+        ACTIVE_PERIOD_CACHE[cache_key] = (active_period_begin, active_period_end)
+
+    active_period_begin, active_period_end = ACTIVE_PERIOD_CACHE[cache_key]
     return bool(active_period_begin <= check_time < active_period_end)
 
 def pause_if_out_of_upload_period(active_period_begin_hour=ACTIVE_PERIOD_BEGIN_HOUR,
@@ -361,21 +696,55 @@ def pause_if_out_of_upload_period(active_period_begin_hour=ACTIVE_PERIOD_BEGIN_H
 
     return False
 
+def get_cached_upload_url(config):
+    """Function getting this thread's cached upload URL, fetching a fresh one if needed."""
+    if getattr(UPLOAD_URL_CACHE, 'upload_url', None) is None:
+        UPLOAD_URL_CACHE.upload_url, UPLOAD_URL_CACHE.upload_auth_token = b2_get_upload_url(
+                config['api_url'], config['auth_token'], config['b2_bucket_id'])
+    return UPLOAD_URL_CACHE.upload_url, UPLOAD_URL_CACHE.upload_auth_token
+
+def invalidate_cached_upload_url():
+    """Function discarding this thread's cached upload URL after a failure."""
+    UPLOAD_URL_CACHE.upload_url = None
+    UPLOAD_URL_CACHE.upload_auth_token = None
+
+def get_cached_upload_part_url(config, file_id):
+    """Function getting this thread's cached upload part URL, fetching a fresh one if needed."""
+    if not hasattr(UPLOAD_URL_CACHE, 'part_urls'):
+        UPLOAD_URL_CACHE.part_urls = {}
+    if UPLOAD_URL_CACHE.part_urls.get(file_id) is None:
+        UPLOAD_URL_CACHE.part_urls[file_id] = b2_get_upload_part_url(config['api_url'],
+                                                                     config['auth_token'],
+                                                                     file_id)
+    return UPLOAD_URL_CACHE.part_urls[file_id]
+
+def invalidate_cached_upload_part_url(file_id):
+    """Function discarding this thread's cached upload part URL after a failure."""
+    UPLOAD_URL_CACHE.part_urls[file_id] = None
+
 def upload_archive_file_part(volume,
                              file_part_name,
                              config,
                              upload_attempts=UPLOAD_ATTEMPTS,
-                             backoff_modifier=BACKOFF_MODIFIER):
+                             backoff_modifier=BACKOFF_MODIFIER,
+                             disable_pause=DISABLE_PAUSE):
     """Function gathering file info and uploading file to B2 bucket."""
+    if not disable_pause:
+        with PAUSE_LOCK:
+            if pause_if_out_of_upload_period():
+                # Refresh auth_token after pause.
+                config = b2_authorize_account(config)
+
     file_info = get_file_info(file_part_name, config['backup_directory'])
     for i in range(upload_attempts):
-        upload_url, upload_auth_token = b2_get_upload_url(config['api_url'],
-                                                          config['auth_token'],
-                                                          config['b2_bucket_id'])
+        upload_url, upload_auth_token = get_cached_upload_url(config)
         if upload_url is not None and upload_auth_token is not None:
             if b2_upload_file(volume, file_info, upload_url, upload_auth_token):
                 return True
 
+        # An upload URL is reusable until it fails; fetch a fresh one on the next attempt.
+        invalidate_cached_upload_url()
+
         # Exponential backoff.  Sleep after each attempt except for the last.
         if i < upload_attempts - 1:
             format_log(f'Backing off for {backoff_modifier * i**2} seconds.')
@@ -384,19 +753,106 @@ def upload_archive_file_part(volume,
     format_log(f'Failed to upload {file_part_name} to B2 after {upload_attempts} tries.')
     return False
 
+def upload_large_file_part(file_part_name,
+                           part_number,
+                           file_id,
+                           config,
+                           upload_attempts=UPLOAD_ATTEMPTS,
+                           backoff_modifier=BACKOFF_MODIFIER,
+                           disable_pause=DISABLE_PAUSE):
+    """Function uploading one part of a B2 large file.  Returns the part's SHA-1."""
+    if not disable_pause:
+        with PAUSE_LOCK:
+            if pause_if_out_of_upload_period():
+                # Refresh auth_token after pause.
+                config = b2_authorize_account(config)
+
+    file_info = get_file_info(file_part_name, config['backup_directory'])
+    for i in range(upload_attempts):
+        upload_url, upload_auth_token = get_cached_upload_part_url(config, file_id)
+        if upload_url is not None and upload_auth_token is not None:
+            if b2_upload_part(file_info, part_number, upload_url, upload_auth_token):
+                return file_info['file_hash']
+
+        # An upload URL is reusable until it fails; fetch a fresh one on the next attempt.
+        invalidate_cached_upload_part_url(file_id)
+
+        # Exponential backoff.  Sleep after each attempt except for the last.
+        if i < upload_attempts - 1:
+            format_log(f'Backing off for {backoff_modifier * i**2} seconds.')
+            time.sleep(backoff_modifier * i**2)
+
+    format_log(f'Failed to upload {file_part_name} to B2 after {upload_attempts} tries.')
+    return None
+
+def use_large_file_upload(config, file_part_names):
+    """Function determining whether a volume's parts satisfy the B2 large file constraints."""
+    return len(file_part_names) >= 2 and config['encrypted_file_part_size'] >= B2_MINIMUM_PART_SIZE
+
+def part_number_from_name(file_part_name):
+    """Function extracting the numeric part number from a part filename."""
+    return int(file_part_name.rsplit('part', 1)[1])
+
+def upload_volume_as_large_file(volume, file_part_names, config, executor, thismonth=THISMONTH,
+                                disable_pause=DISABLE_PAUSE):
+    """Function uploading a volume's encrypted parts as a single B2 large file."""
+    file_name = f"{volume}/{thismonth}-{volume}{config['archive_suffix']}.enc"
+    file_id = b2_start_large_file(config, file_name)
+    if file_id is None:
+        return False
+
+    # B2 part numbers come from each filename's trailing digits, not enumeration order:
+    # past part 999 the names grow to four digits and sort lexicographically out of order
+    # (part1000 lands between part100 and part101), which would assemble the large file
+    # scrambled.
+    futures = {}
+    for file_part_name in file_part_names:
+        part_number = part_number_from_name(file_part_name)
+        futures[executor.submit(upload_large_file_part, file_part_name, part_number, file_id,
+                                config, disable_pause=disable_pause)] = part_number
+    part_sha1s = {}
+    for future in concurrent.futures.as_completed(futures):
+        part_sha1s[futures[future]] = future.result()
+
+    if None in part_sha1s.values():
+        format_log(f'Failed to upload all parts of {file_name}.  Cancelling large file.')
+        b2_cancel_large_file(config, file_id)
+        return False
+
+    return b2_finish_large_file(config, file_id,
+                                [part_sha1s[part_number] for part_number in sorted(part_sha1s)])
+
 def upload_archive_files(config, thismonth=THISMONTH, disable_pause=DISABLE_PAUSE):
-    """Function uploading archive files."""
+    """Function uploading archive files with a pool of concurrent part uploads."""
     config = b2_authorize_account(config)
     format_log('Uploading volumes.')
-    for volume in config['volumes']:
-        format_log(f'Uploading volume: {volume}')
-        for file_part_name in list_files_matching(rf"{thismonth}-{volume}\.tar\.gz\.enc.part\d+$",
-                                                  config['backup_directory']):
-            if not disable_pause and pause_if_out_of_upload_period():
-                # Refresh auth_token after pause.
-                config = b2_authorize_account(config)
-            # TODO: Key off of return value of upload_archive_file_part.
-            upload_archive_file_part(volume, file_part_name, config)
+    # One directory scan groups every part by volume, instead of re-scanning per volume.
+    part_pattern = re.compile(
+            rf"{thismonth}-(?P<volume>{volumes_pattern(config)}){archive_suffix_pattern(config)}\.enc\.part\d+$")
+    parts_by_volume = {volume: [] for volume in config['volumes']}
+    for filename in directory_snapshot(config['backup_directory'],
+                                       os.stat(config['backup_directory']).st_mtime_ns):
+        match = part_pattern.match(filename)
+        if match:
+            parts_by_volume[match.group('volume')].append(filename)
+    for file_part_names in parts_by_volume.values():
+        # Numeric order, not name order: part1000 sorts lexicographically before part101.
+        file_part_names.sort(key=part_number_from_name)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config['upload_workers']) as executor:
+        for volume in config['volumes']:
+            format_log(f'Uploading volume: {volume}')
+            file_part_names = parts_by_volume[volume]
+            if use_large_file_upload(config, file_part_names):
+                # TODO: Key off of return value of upload_volume_as_large_file.
+                upload_volume_as_large_file(volume, file_part_names, config, executor,
+                                            thismonth=thismonth, disable_pause=disable_pause)
+            else:
+                futures = [executor.submit(upload_archive_file_part, volume, file_part_name, config,
+                                           disable_pause=disable_pause)
+                           for file_part_name in file_part_names]
+                # TODO: Key off of return value of upload_archive_file_part.
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
 
 def verify_uploaded_files(config, thismonth=THISMONTH):
     """Function verifying that all files uploaded successfully."""
@@ -406,13 +862,15 @@ def verify_uploaded_files(config, thismonth=THISMONTH):
         if files == []:
             format_log(f'{volume} not found on B2.')
             return False
-        for file_part_name in list_files_matching(rf"{thismonth}-{volume}\.tar\.gz\.enc.part\d+$",
-                                                  config['backup_directory']):
-            file_found = False
-            for file_info in files:
-                if file_info[0] == f'{volume}/{file_part_name}':
-                    file_found = True
-            if not file_found:
+        remote_file_names = {file_info[0] for file_info in files}
+        # A large file upload is assembled server-side into a single object; B2 has already
+        # verified each part's SHA-1, so its presence verifies the whole volume.
+        if f"{volume}/{thismonth}-{volume}{config['archive_suffix']}.enc" in remote_file_names:
+            continue
+        for file_part_name in list_files_matching(
+                re.compile(rf"{thismonth}-{re.escape(volume)}{archive_suffix_pattern(config)}\.enc\.part\d+$"),
+                config['backup_directory']):
+            if f'{volume}/{file_part_name}' not in remote_file_names:
                 format_log(f'{file_part_name} not found on B2.')
                 return False
     return True
@@ -420,8 +878,9 @@ def verify_uploaded_files(config, thismonth=THISMONTH):
 def list_local_archive_file_parts_from_date(config, archive_file_part_date):
     """Function listing local encrypted archive file parts from a particular date."""
     format_log(f'List local encrypted archive file parts from {archive_file_part_date}.')
-    file_list = list_files_matching(rf"{archive_file_part_date}-({'|'.join(config['volumes'])})\.tar\.gz\.enc.part",
-                                    config['backup_directory'])
+    file_list = list_files_matching(
+                re.compile(rf"{archive_file_part_date}-({volumes_pattern(config)}){archive_suffix_pattern(config)}\.enc\.part"),
+                config['backup_directory'])
     for filename in file_list:
         format_log(filename)
     return file_list
@@ -435,7 +894,7 @@ def delete_current_local_archive_file_parts(config, thismonth=THISMONTH):
 def list_local_archives_from_date(config, archive_file_date):
     """Function listing local tar'd and gzip'd archives from a particular date."""
     format_log(f'List local archived volumes from {archive_file_date}.')
-    file_list = list_files_matching(rf"{archive_file_date}-({'|'.join(config['volumes'])})\.tar\.gz",
+    file_list = list_files_matching(re.compile(rf"{archive_file_date}-({volumes_pattern(config)}){archive_suffix_pattern(config)}"),
                                     config['backup_directory'])
     for filename in file_list:
         format_log(filename)
@@ -450,9 +909,9 @@ def delete_old_local_archive_files(config, old_file_date=THREE_MONTHS_AGO):
 def b2_delete_file(filename, file_id, api_url, auth_token, debug=DEBUG):
     """Function deleting a file from b2."""
     try:
-        response = requests.post(f"{api_url}/b2api/v2/b2_delete_file_version",
+        response = SESSION.post(f"{api_url}/b2api/v2/b2_delete_file_version",
                                  headers={'Authorization': auth_token},
-                                 data=f'{{"fileName": "{filename}", "fileId": "{file_id}"}}')
+                                 json={'fileName': filename, 'fileId': file_id})
         if debug:
             format_log(response.text)
 
@@ -463,9 +922,8 @@ def b2_delete_file(filename, file_id, api_url, auth_token, debug=DEBUG):
         format_log(f'HTTP Status Code: {response.status_code}')
     except requests.exceptions.ConnectionError as err:
         format_log(f"A ConnectionError occurred for {filename}: {err}")
-    except:
-        format_log('An unknown error occurred.')
-        format_log(sys.exc_info())
+    except requests.exceptions.RequestException as err:
+        format_log(f'A RequestException occurred: {err}')
 
     format_log(f"Failed to delete {filename} from B2.")
     return False
@@ -505,9 +963,11 @@ def main():
     config = read_config()
     config = check_and_update_config(config)
     create_archives(config)
-    list_local_archives(config)
+    if DEBUG:
+        list_local_archives(config)
     encrypt_archives(config)
-    list_local_encrypted_archives(config)
+    if DEBUG:
+        list_local_encrypted_archives(config)
     upload_archive_files(config)
     verify_and_cleanup(config)
 